@@ -12,6 +12,8 @@ _DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
 _TIME_RE = re.compile(r"^\d{2}:\d{2}:\d{2}$")
 _TIME_HM_RE = re.compile(r"^\d{2}:\d{2}$")
 _DEC_RE = re.compile(r"^\d+(\.\d{1,2})?$")  # string con punto y hasta 2 decimales
+_CTRL_RE = re.compile(r"[\r\n\t]+")
+_MULTI_WS_RE = re.compile(r"\s{2,}")
 
 def _fmt_dec(val: float | int | str, dec: int = 2) -> str:
     """
@@ -32,8 +34,8 @@ def _sanitize_text(s: Any, min_len: int = 0) -> str:
     if s is None:
         s = ""
     s = str(s)
-    s = re.sub(r"[\r\n\t]+", " ", s)
-    s = re.sub(r"\s{2,}", " ", s).strip()
+    s = _CTRL_RE.sub(" ", s)
+    s = _MULTI_WS_RE.sub(" ", s).strip()
     if min_len and len(s) < min_len:
         s += " " * (min_len - len(s))
     return s
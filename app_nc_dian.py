@@ -16,12 +16,12 @@
 #
 from __future__ import annotations
 import io
-import json
 from decimal import Decimal, ROUND_HALF_UP
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, List
 
+import orjson
 import pandas as pd
 import streamlit as st
 from lxml import etree
@@ -37,17 +37,34 @@ def _dec(v) -> Decimal:
     return Decimal(str(v))
 
 
+_CENT = Decimal("0.01")  # cuantizador precalculado para _fmt2
+
+
 def _fmt2(v) -> str:
     """Formatea con 2 decimales, separador punto."""
-    return str(_dec(v).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
+    return str(_dec(v).quantize(_CENT, rounding=ROUND_HALF_UP))
 
 
 def _load_json_bytes(data: bytes) -> Dict[str, Any]:
-    return json.loads(data.decode("utf-8"))
+    # orjson parsea UTF-8 directo de bytes (ruta C), sin decode intermedio
+    return orjson.loads(data)
+
+
+def _dumps_pretty(obj: Any) -> bytes:
+    """Serializa a JSON indentado (UTF-8, bytes) por la ruta C de orjson."""
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
 
 
 # ---------------------- Extracción de servicios con valor ----------------------
 
+# Columnas fijas de las filas que produce extraer_servicios_con_valor: con la
+# lista explícita pandas no tiene que inferir el orden escaneando los dicts.
+COLUMNAS_SERVICIOS = [
+    "incluir", "paciente", "tabla", "u_idx", "s_idx",
+    "codPrestador", "codConsulta", "codProcedimiento", "codServicio",
+    "fechaInicioAtencion", "valor_original", "valor_nc",
+]
+
 def extraer_servicios_con_valor(rips: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
     Recorre usuarios -> servicios -> listas y recoge los registros con vrServicio > 0.
@@ -55,6 +72,9 @@ def extraer_servicios_con_valor(rips: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
     filas: List[Dict[str, Any]] = []
     usuarios = rips.get("usuarios", [])
+    # Alias locales para el loop caliente (LOAD_FAST en vez de LOAD_GLOBAL)
+    dec = _dec
+    filas_append = filas.append
     for u_idx, u in enumerate(usuarios):
         paciente = str(u.get("numDocumentoIdentificacion", "")) or ""
         servicios = u.get("servicios") or {}
@@ -62,9 +82,9 @@ def extraer_servicios_con_valor(rips: Dict[str, Any]) -> List[Dict[str, Any]]:
             if not isinstance(regs, list):
                 continue
             for s_idx, reg in enumerate(regs):
-                vr = _dec(reg.get("vrServicio", 0))
+                vr = dec(reg.get("vrServicio", 0))
                 if vr > 0:
-                    filas.append({
+                    filas_append({
                         "incluir": True,
                         "paciente": paciente,
                         "tabla": tabla,
@@ -83,6 +103,35 @@ def extraer_servicios_con_valor(rips: Dict[str, Any]) -> List[Dict[str, Any]]:
 
 # ---------------------- Construcción JSON Afacturar/TTP ----------------------
 
+# Bloques idénticos en toda línea de detalle. Se comparten entre líneas (el
+# payload solo se serializa, nunca se muta), evitando realocar 5 dicts por fila.
+_DET_CODIFICACION = {
+    "cod_grupo_bien_servicio": "1",
+    "nombre_grupo_bien_servicio": "UNSPSC",
+    "cod_segmento_bien_servicio": "7811",
+    "cod_bien_servicio": "78111000",
+}
+_DET_REGALO = {
+    "es_regalo": False,
+    "cod_precio_referencia": "0",
+    "precio_referencia": "0.00",
+}
+_DET_CARGO_DESCUENTO = {
+    "es_descuento": True,
+    "porcentaje_cargo_descuento": "0.00",
+    "valor_base_cargo_descuento": "0.00",
+    "valor_cargo_descuento": "0.00",
+}
+_DET_IMPUESTOS = {
+    "codigo_impuesto": "0",
+    "porcentaje_impuesto": "0.00",
+    "valor_base_impuesto": "0.00",
+    "valor_impuesto": "0.00",
+}
+_DET_RETENCIONES = [
+    {"codigo": "0", "porcentaje": "0.00", "valor_base": "0.00", "valor_retenido": "0.00"}
+]
+
 def construir_payload_afacturar_ttp(
     rips: Dict[str, Any],
     filas_df: pd.DataFrame,
@@ -122,32 +171,11 @@ def construir_payload_afacturar_ttp(
             "nota_detalle": f"Ajuste parcial - Paciente {paciente}",
             "marca": "N/A",
             "modelo": "N/A",
-            "codificacion_estandar": {
-                "cod_grupo_bien_servicio": "1",
-                "nombre_grupo_bien_servicio": "UNSPSC",
-                "cod_segmento_bien_servicio": "7811",
-                "cod_bien_servicio": "78111000",
-            },
-            "regalo": {
-                "es_regalo": False,
-                "cod_precio_referencia": "0",
-                "precio_referencia": "0.00",
-            },
-            "cargo_descuento": {
-                "es_descuento": True,
-                "porcentaje_cargo_descuento": "0.00",
-                "valor_base_cargo_descuento": "0.00",
-                "valor_cargo_descuento": "0.00",
-            },
-            "impuestos_detalle": {
-                "codigo_impuesto": "0",
-                "porcentaje_impuesto": "0.00",
-                "valor_base_impuesto": "0.00",
-                "valor_impuesto": "0.00",
-            },
-            "retenciones_detalle": [
-                {"codigo": "0", "porcentaje": "0.00", "valor_base": "0.00", "valor_retenido": "0.00"}
-            ],
+            "codificacion_estandar": _DET_CODIFICACION,
+            "regalo": _DET_REGALO,
+            "cargo_descuento": _DET_CARGO_DESCUENTO,
+            "impuestos_detalle": _DET_IMPUESTOS,
+            "retenciones_detalle": _DET_RETENCIONES,
             "valores_unitarios": {
                 "valor_impuesto_1": "0.00",
                 "valor_impuesto_2": "0.00",
@@ -163,6 +191,8 @@ def construir_payload_afacturar_ttp(
         })
 
     ahora = datetime.now()
+    fecha_hoy = ahora.strftime("%Y-%m-%d")
+    hora_ahora = ahora.strftime("%H:%M:%S")
     totales = {
         "valor_base": _fmt2(total),
         "valor_base_calculo_impuestos": "0.00",
@@ -188,8 +218,8 @@ def construir_payload_afacturar_ttp(
                 {
                     "encabezado": {
                         "id_nota_credito": id_nc,
-                        "fecha": ahora.strftime("%Y-%m-%d"),
-                        "hora": ahora.strftime("%H:%M:%S"),
+                        "fecha": fecha_hoy,
+                        "hora": hora_ahora,
                         "nota": [
                             "{'MOTIVO':'Nota crédito parcial','SOPORTE':'Ajuste/Glosa','OBS':'Ref %s'}" % ref_doc
                         ],
@@ -209,8 +239,8 @@ def construir_payload_afacturar_ttp(
                     "informacion_documento": {
                         "id_documento": ref_doc,
                         "codigo_unico_documento": cude_ref,
-                        "fecha": ahora.strftime("%Y-%m-%d"),
-                        "hora": ahora.strftime("%H:%M:%S"),
+                        "fecha": fecha_hoy,
+                        "hora": hora_ahora,
                         "codigo_tipo_documento": "TTP",
                     },
                     "detalle_factura": detalle,
@@ -288,6 +318,12 @@ NS_CN = {
     "cac": "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2",
 }
 
+# Tags calificados precalculados (evita reformatear el f-string por línea)
+_TAG_CN_LINE = f"{{{NS_CN['cac']}}}CreditNoteLine"
+_TAG_CN_ID = f"{{{NS_CN['cbc']}}}ID"
+_TAG_CN_QTY = f"{{{NS_CN['cbc']}}}CreditedQuantity"
+_TAG_CN_LEA = f"{{{NS_CN['cbc']}}}LineExtensionAmount"
+
 
 def _ensure_text(el, text):
     if el is not None:
@@ -301,6 +337,23 @@ def _set_money(el, amount: Decimal, currency: str = "COP"):
     el.text = _fmt2(amount)
 
 
+def _agregar_linea_cn(cn_root, numero: str, amount: Decimal, moneda: str):
+    """
+    Crea una cac:CreditNoteLine (ID, CreditedQuantity, LineExtensionAmount)
+    y la anexa al CreditNote. Los hijos se agregan en bloque con extend().
+    """
+    line = etree.SubElement(cn_root, _TAG_CN_LINE)
+    id_el = etree.Element(_TAG_CN_ID)
+    id_el.text = numero
+    qty = etree.Element(_TAG_CN_QTY)
+    qty.set("unitCode", "94")
+    qty.text = "1"
+    lea = etree.Element(_TAG_CN_LEA)
+    _set_money(lea, amount, moneda)
+    line.extend((id_el, qty, lea))
+    return line
+
+
 def construir_attacheddocument_desde_plantilla(
     template_bytes: bytes,
     *,
@@ -358,13 +411,7 @@ def construir_attacheddocument_desde_plantilla(
             old.getparent().remove(old)
 
         # Crear una sola línea (ID=1)
-        line = etree.SubElement(cn_root, f"{{{NS_CN['cac']}}}CreditNoteLine")
-        etree.SubElement(line, f"{{{NS_CN['cbc']}}}ID").text = "1"
-        qty = etree.SubElement(line, f"{{{NS_CN['cbc']}}}CreditedQuantity")
-        qty.set("unitCode", "94")
-        qty.text = "1"
-        lea = etree.SubElement(line, f"{{{NS_CN['cbc']}}}LineExtensionAmount")
-        _set_money(lea, total, moneda)
+        _agregar_linea_cn(cn_root, "1", total, moneda)
 
         # LineCountNumeric = 1
         _ensure_text(cn_linecount, "1")
@@ -380,13 +427,7 @@ def construir_attacheddocument_desde_plantilla(
         for i, row in enumerate(sel.itertuples(index=False), start=1):
             v = _dec(row.valor_nc)
             total_payable += v
-            line = etree.SubElement(cn_root, f"{{{NS_CN['cac']}}}CreditNoteLine")
-            etree.SubElement(line, f"{{{NS_CN['cbc']}}}ID").text = str(i)
-            qty = etree.SubElement(line, f"{{{NS_CN['cbc']}}}CreditedQuantity")
-            qty.set("unitCode", "94")
-            qty.text = "1"
-            lea = etree.SubElement(line, f"{{{NS_CN['cbc']}}}LineExtensionAmount")
-            _set_money(lea, v, moneda)
+            _agregar_linea_cn(cn_root, str(i), v, moneda)
 
         _ensure_text(cn_linecount, str(len(sel)))
 
@@ -415,6 +456,32 @@ def construir_attacheddocument_desde_plantilla(
 
 # ---------------------- UI Streamlit ----------------------
 
+@st.cache_data(show_spinner=False, max_entries=4)
+def _cargar_rips_cacheado(data: bytes) -> Dict[str, Any]:
+    """Parse cacheado por contenido: el rerun no re-parsea el mismo upload."""
+    return _load_json_bytes(data)
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _filas_servicios_cacheadas(data: bytes) -> List[Dict[str, Any]]:
+    """Extracción cacheada por contenido del upload (misma clave que el parse)."""
+    return extraer_servicios_con_valor(_cargar_rips_cacheado(data))
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _validar_plantilla(tpl_bytes: bytes) -> bool:
+    """
+    Valida (una sola vez por contenido) que la plantilla sea un AttachedDocument
+    con CreditNote en CDATA. Cacheado: el rerun de Streamlit no re-parsea el XML.
+    """
+    construir_attacheddocument_desde_plantilla(
+        tpl_bytes, id_nc="__TEST__", parent_document_id="__TEST__",
+        filas_df=pd.DataFrame([{"incluir": True, "valor_nc": 1}]), modo_lineas="UNA_LINEA"
+    )
+    return True
+
+
+
 st.set_page_config(page_title="NC (JSON TTP + AttachedDocument DIAN)", page_icon="🧾", layout="wide")
 st.title("🧾 Generador de Nota Crédito — JSON TTP + AttachedDocument DIAN (desde plantilla)")
 
@@ -428,21 +495,22 @@ with st.expander("1) Cargar archivos de entrada", expanded=True):
         st.caption("Usa aquí **tu XML que ya pasó validador**. No se alterará la estructura, solo valores mínimos.")
 
     loaded_rips = None
+    rips_bytes = None
     tpl_bytes = None
     if up_rips is not None:
         try:
-            loaded_rips = _load_json_bytes(up_rips.read())
+            rips_bytes = up_rips.getvalue()
+            loaded_rips = _cargar_rips_cacheado(rips_bytes)
             st.success("RipsDocumento cargado.")
         except Exception as e:
             st.error(f"JSON inválido: {e}")
 
     if up_tpl is not None:
         try:
-            tpl_bytes = up_tpl.read()
+            # getvalue() no consume el buffer y Streamlit memoiza los bytes por archivo
+            tpl_bytes = up_tpl.getvalue()
             # Validación rápida de que sea AttachedDocument y contenga Description con CreditNote
-            _ = construir_attacheddocument_desde_plantilla(
-                tpl_bytes, id_nc="__TEST__", parent_document_id="__TEST__", filas_df=pd.DataFrame([{"incluir": True, "valor_nc": 1}]), modo_lineas="UNA_LINEA"
-            )
+            _validar_plantilla(tpl_bytes)
             st.success("Plantilla AttachedDocument válida (se detectó CreditNote en CDATA).")
         except Exception as e:
             st.error(f"Plantilla inválida: {e}")
@@ -451,16 +519,19 @@ with st.expander("1) Cargar archivos de entrada", expanded=True):
 with st.expander("2) Seleccionar y editar valores de la Nota", expanded=True):
     df = pd.DataFrame()
     if loaded_rips is not None:
-        filas = extraer_servicios_con_valor(loaded_rips)
+        filas = _filas_servicios_cacheadas(rips_bytes)
         if not filas:
             st.warning("No se encontraron servicios con `vrServicio > 0` en el JSON.")
         else:
-            df = pd.DataFrame(filas)
+            df = pd.DataFrame.from_records(filas, columns=COLUMNAS_SERVICIOS)
+            df["valor_original"] = df["valor_original"].astype("float64")
+            df["valor_nc"] = df["valor_nc"].astype("float64")
             st.caption("Marca los ítems a incluir y ajusta `valor_nc` según corresponda.")
             edited = st.data_editor(
                 df,
                 num_rows="dynamic",
                 use_container_width=True,
+                height=420,  # viewport acotado: la tabla grande se virtualiza, no crece el DOM
                 column_config={
                     "incluir": st.column_config.CheckboxColumn("Incluir", help="Marcar para aplicar NC"),
                     "valor_original": st.column_config.NumberColumn("Valor original", format="%.2f", disabled=True),
@@ -474,7 +545,14 @@ with st.expander("2) Seleccionar y editar valores de la Nota", expanded=True):
             with colA:
                 if st.button("⬇️ Descargar plantilla Excel (edición masiva)"):
                     buf = io.BytesIO()
-                    with pd.ExcelWriter(buf, engine="xlsxwriter") as wr:
+                    # in_memory: arma el workbook sin archivos temporales en disco.
+                    # OJO: no usar constant_memory aquí — xlsxwriter lo desactiva si
+                    # va junto con in_memory, y usado solo descarta celdas en silencio
+                    # porque to_excel escribe columna a columna (fuera de orden).
+                    with pd.ExcelWriter(
+                        buf, engine="xlsxwriter",
+                        engine_kwargs={"options": {"in_memory": True}},
+                    ) as wr:
                         df.to_excel(wr, index=False, sheet_name="NC")
                     st.download_button(
                         "Descargar NC.xlsx",
@@ -487,21 +565,29 @@ with st.expander("2) Seleccionar y editar valores de la Nota", expanded=True):
                 up_xlsx = st.file_uploader("Cargar plantilla Excel editada", type=["xlsx"])
                 if up_xlsx is not None:
                     try:
-                        dfx = pd.read_excel(up_xlsx)
+                        # calamine (Rust) lee el xlsx bastante más rápido que openpyxl
+                        dfx = pd.read_excel(up_xlsx, engine="calamine")
                         # Merge por claves (u_idx, s_idx, tabla, paciente)
                         keys = ["u_idx", "s_idx", "tabla", "paciente"]
+                        # Chequeo de columnas requeridas en un solo set-difference
+                        faltantes = set(keys + ["valor_nc", "incluir"]) - set(dfx.columns)
+                        if faltantes:
+                            raise ValueError(f"columnas faltantes en la plantilla: {sorted(faltantes)}")
                         df = df.drop(columns=["valor_nc"], errors="ignore").merge(
                             dfx[keys + ["valor_nc", "incluir"]],
                             on=keys, how="left", suffixes=("", "_x")
                         )
-                        # Si vienen NaN en valor_nc (no editados), repone el existente
+                        # Coerción vectorizada: celdas de texto del Excel pasan a NaN
+                        # y los NaN (no editados) reponen el valor original
+                        df["valor_nc"] = pd.to_numeric(df["valor_nc"], errors="coerce")
                         df["valor_nc"] = df["valor_nc"].fillna(df["valor_original"])
-                        df["incluir"] = df["incluir"].fillna(True)
+                        df["incluir"] = df["incluir"].fillna(True).astype(bool)
                         st.success("Plantilla aplicada.")
                     except Exception as e:
                         st.error(f"No se pudo leer el Excel: {e}")
             if not df.empty:
-                total_sel = df[df["incluir"] == True]["valor_nc"].sum()  # noqa: E712
+                # Máscara booleana + selección de columna en un solo paso (sin DataFrame intermedio)
+                total_sel = df.loc[df["incluir"] == True, "valor_nc"].sum()  # noqa: E712
                 st.info(f"Total seleccionado: **{_fmt2(total_sel)}**")
 
 with st.expander("3) Parámetros de la Nota y salida", expanded=True):
@@ -521,6 +607,8 @@ with st.expander("3) Parámetros de la Nota y salida", expanded=True):
 
     if "payload" not in st.session_state:
         st.session_state["payload"] = None
+    if "payload_bytes" not in st.session_state:
+        st.session_state["payload_bytes"] = None
     if "xml_bytes" not in st.session_state:
         st.session_state["xml_bytes"] = None
 
@@ -535,8 +623,10 @@ with st.expander("3) Parámetros de la Nota y salida", expanded=True):
                     doc_obligado=doc_obligado, moneda=moneda, prefijo=prefijo
                 )
                 st.session_state["payload"] = payload
+                # Serializa una sola vez al construir; los reruns reutilizan los bytes
+                st.session_state["payload_bytes"] = _dumps_pretty(payload)
                 st.success("JSON construido.")
-                st.code(json.dumps(payload, ensure_ascii=False, indent=2), language="json")
+                st.code(st.session_state["payload_bytes"].decode(), language="json")
         except Exception as e:
             st.error(f"Error construyendo JSON: {e}")
 
@@ -561,7 +651,7 @@ with st.expander("3) Parámetros de la Nota y salida", expanded=True):
         if st.session_state.get("payload"):
             st.download_button(
                 "⬇️ Descargar JSON Afacturar",
-                data=json.dumps(st.session_state["payload"], ensure_ascii=False, indent=2).encode("utf-8"),
+                data=st.session_state["payload_bytes"],
                 file_name=f"{id_nc}_payload.json",
                 mime="application/json",
                 use_container_width=True
@@ -1,5 +1,6 @@
 # app_rips_notas2.py
-import json, traceback
+import traceback
+import orjson
 import streamlit as st
 import requests
 from datetime import datetime
@@ -37,55 +38,60 @@ def main():
             type="password"
         )
 
-    st.header("1) Encabezado")
-    c1, c2, c3, c4 = st.columns(4)
-    with c1: id_nc = st.text_input("id_nota_credito", "NC23349")
-    with c2: fecha = st.text_input("fecha AAAA-MM-DD", datetime.now().strftime("%Y-%m-%d"))
-    with c3: hora = st.text_input("hora HH:MM:SS", datetime.now().strftime("%H:%M:%S"))
-    with c4: prefijo = st.text_input("prefijo", "NC")
-    c5, c6, c7 = st.columns(3)
-    with c5: moneda = st.text_input("moneda", "COP")
-    with c6: tipo_operacion = st.text_input("tipo_operacion", "35")
-    with c7: tipo_nc = st.text_input("tipo_nota_credito (1..5)", "4")
-    nota_str = st.text_area(
-        "nota (string con comillas simples)",
-        "{'MOTIVO':'Ajuste de precio','OBS':'NC parcial'}",
-        height=80
-    )
-
-    st.header("2) Documento afectado")
-    doc_id = st.text_input("id_documento", "TT-000123")
-    cude = st.text_input("codigo_unico_documento (CUDE)", "CUDE_DE_LA_FACTURA_O_DOC")
-    d1, d2 = st.columns(2)
-    with d1: doc_fecha = st.text_input("fecha doc AAAA-MM-DD", fecha)
-    with d2: doc_hora = st.text_input("hora doc HH:MM:SS", "08:15:00")
-    cod_tipo_doc = st.text_input("codigo_tipo_documento", "TTP")
-
-    st.header("3) Servicio mínimo")
-    s1, s2, s3 = st.columns(3)
-    with s1: origen = st.text_input("lugar_origen", "Bogotá")
-    with s2: destino = st.text_input("lugar_destino", "Medellín")
-    with s3: hora_salida = st.text_input("hora_salida HH:MM", "08:30")
-    placa = st.text_input("placa", "ABC123")
-    tipo_veh = st.selectbox("tipo vehiculo", ["AUTOBUS","MICROBUS","BUS"], index=0)
-
-    st.header("4) Línea de detalle")
-    l1, l2, l3 = st.columns(3)
-    with l1: cantidad = st.number_input("cantidad", min_value=1.0, value=1.0, step=1.0)
-    with l2: unidad = st.text_input("unidad_de_cantidad", "94")
-    with l3: vu = st.text_input("valor_unitario", _fmt_dec("4992000"))
-    desc = st.text_input("descripcion", "Servicio transporte pasajero")
-    nota_detalle = st.text_input("nota_detalle", "Ajuste parcial")
-    total = st.text_input("total_nota_credito", _fmt_dec("4992000"))
-    total_pagar = st.text_input("valor_total_a_pagar", _fmt_dec("4992000"))
-
-    st.header("5) Emisor / Generalidades")
-    doc_obligado = st.text_input("documento_obligado (NIT emisor)", "901002487")
+    # st.form: editar los campos no dispara reruns; el script corre al enviar
+    with st.form("nc_form"):
+        st.header("1) Encabezado")
+        c1, c2, c3, c4 = st.columns(4)
+        with c1: id_nc = st.text_input("id_nota_credito", "NC23349")
+        with c2: fecha = st.text_input("fecha AAAA-MM-DD", datetime.now().strftime("%Y-%m-%d"))
+        with c3: hora = st.text_input("hora HH:MM:SS", datetime.now().strftime("%H:%M:%S"))
+        with c4: prefijo = st.text_input("prefijo", "NC")
+        c5, c6, c7 = st.columns(3)
+        with c5: moneda = st.text_input("moneda", "COP")
+        with c6: tipo_operacion = st.text_input("tipo_operacion", "35")
+        with c7: tipo_nc = st.text_input("tipo_nota_credito (1..5)", "4")
+        nota_str = st.text_area(
+            "nota (string con comillas simples)",
+            "{'MOTIVO':'Ajuste de precio','OBS':'NC parcial'}",
+            height=80
+        )
+
+        st.header("2) Documento afectado")
+        doc_id = st.text_input("id_documento", "TT-000123")
+        cude = st.text_input("codigo_unico_documento (CUDE)", "CUDE_DE_LA_FACTURA_O_DOC")
+        d1, d2 = st.columns(2)
+        with d1: doc_fecha = st.text_input("fecha doc AAAA-MM-DD", fecha)
+        with d2: doc_hora = st.text_input("hora doc HH:MM:SS", "08:15:00")
+        cod_tipo_doc = st.text_input("codigo_tipo_documento", "TTP")
+
+        st.header("3) Servicio mínimo")
+        s1, s2, s3 = st.columns(3)
+        with s1: origen = st.text_input("lugar_origen", "Bogotá")
+        with s2: destino = st.text_input("lugar_destino", "Medellín")
+        with s3: hora_salida = st.text_input("hora_salida HH:MM", "08:30")
+        placa = st.text_input("placa", "ABC123")
+        tipo_veh = st.selectbox("tipo vehiculo", ["AUTOBUS","MICROBUS","BUS"], index=0)
+
+        st.header("4) Línea de detalle")
+        l1, l2, l3 = st.columns(3)
+        with l1: cantidad = st.number_input("cantidad", min_value=1.0, value=1.0, step=1.0)
+        with l2: unidad = st.text_input("unidad_de_cantidad", "94")
+        with l3: vu = st.text_input("valor_unitario", _fmt_dec("4992000"))
+        desc = st.text_input("descripcion", "Servicio transporte pasajero")
+        nota_detalle = st.text_input("nota_detalle", "Ajuste parcial")
+        total = st.text_input("total_nota_credito", _fmt_dec("4992000"))
+        total_pagar = st.text_input("valor_total_a_pagar", _fmt_dec("4992000"))
+
+        st.header("5) Emisor / Generalidades")
+        doc_obligado = st.text_input("documento_obligado (NIT emisor)", "901002487")
+
+        construir = st.form_submit_button("🧩 Construir JSON")
+
     tipo_amb = "2" if ambiente != "PRODUCCIÓN" else "1"
 
-    b1, b2, b3 = st.columns(3)
+    b2, b3 = st.columns(2)
 
-    if b1.button("🧩 Construir JSON"):
+    if construir:
         try:
             encabezado = {
                 "id_nota_credito": id_nc,
@@ -195,7 +201,7 @@ def main():
             )
 
             st.success("✅ JSON construido correctamente.")
-            st.code(json.dumps(payload, ensure_ascii=False, indent=2), language="json")
+            st.code(orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode(), language="json")
             st.session_state["payload"] = payload
             st.session_state["base"] = base
             st.session_state["token"] = token
@@ -207,7 +213,7 @@ def main():
         if "payload" not in st.session_state:
             st.warning("Primero construye el JSON.")
         else:
-            data = json.dumps(st.session_state["payload"], ensure_ascii=False, indent=2).encode("utf-8")
+            data = orjson.dumps(st.session_state["payload"], option=orjson.OPT_INDENT_2)
             st.download_button(
                 "Descargar archivo",
                 data=data,
@@ -236,7 +242,8 @@ def main():
                 r = requests.post(url, headers=headers, json=st.session_state["payload"], timeout=90)
             st.write("Status:", r.status_code)
             try:
-                st.json(r.json())
+                # st.code es mucho más liviano en el navegador que el viewer de st.json
+                st.code(orjson.dumps(r.json(), option=orjson.OPT_INDENT_2).decode(), language="json")
             except Exception:
                 st.code(r.text)
         except Exception: